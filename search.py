@@ -32,11 +32,167 @@
 import sys
 import os
 import platform
+import re
+import shutil
 import subprocess
 import shlex
+import fnmatch
+import mmap
+import sqlite3
+import time
+# Optional regex engines for the --native scan path. hyperscan compiles
+# to a SIMD-accelerated DFA, google-re2 never backtracks on alternations,
+# and the third-party regex module handles complex alternations without
+# the catastrophic backtracking the stdlib engine is prone to. All are
+# picked up when installed; the stdlib re module is the always-available
+# fallback. --engine overrides the probe for benchmarking.
+try:
+    import hyperscan
+except ImportError:
+    hyperscan = None
+try:
+    import re2
+except ImportError:
+    re2 = None
+try:
+    import regex
+except ImportError:
+    regex = None
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
 from textwrap import dedent
 from argparse import ArgumentParser, RawDescriptionHelpFormatter, RawTextHelpFormatter
 __author__  = 'Norman MEINZER'
+# Directories that are pruned from the search by default. Pruning stops
+# `find` from descending into them at all, which saves one getdents/stat
+# per skipped entry - usually the dominant cost on large trees.
+DEFAULT_SKIP_DIRS = frozenset((
+    '.git', 'node_modules', '.venv', '__pycache__',
+    'build', 'dist', 'target', '.tox'))
+
+def _build_file_type_categories():
+    """ This is an embedded configuration of file_type categories.
+
+    A file_type category consists of size, the match-flag, and extensions.
+    - size : Optional criteria to reduce the number of file findings
+             through the file size.
+    - match: True  --> Find files that match the extensions
+             False --> Find files that don't match the extensions.
+                       These entries are automatically generated.
+    - extensions: Mandatory list of file extensions to search for.
+
+    The categories are pure data, so they are built exactly once at
+    import time (see _FILE_TYPE_CATEGORIES below) instead of on every
+    invocation.
+    """
+    # TODO too many matches with 'import mimetypes'?
+    file_type_categories = {
+        'text' :
+            { 'size' : '', 'match' : True, 'extensions' :
+                ('txt', 'md', 'markdown', 'csv', 'url') },
+        'markup-text' :
+            { 'size' : '', 'match' : True, 'extensions' :
+                ('tex', 'htm', 'html', 'rtf') },
+        'code' :
+            { 'size' : '', 'match' : True, 'extensions' :
+                ('c', 'cpp', 'cc', 'h', 'hpp', 'java', 'swift', 'php', 'rb', 'el', 'lsp', 'm', 'cp') },
+        'configuration' :
+            { 'size' : '', 'match' : True, 'extensions' :
+                ('cfg', 'reg', 'yaml', 'ini', 'xml', 'json') },
+        'script' :
+            { 'size' : '', 'match' : True, 'extensions' :
+                ('sh', 'py', 'pl', 'mk', 'mak', 'cmake', 'bat', 'ps1', 'vb', 'vbs', 'ws', 'scpt', 'command', 'tcl', 'vim', 'r', 'lua') },
+        #'' :
+            #{ 'size' : '', 'match' : True, 'extensions' : ( '', '' ) },
+        'image' :
+            { 'size' : '+4k',  'match' : True, 'extensions' :
+                ('png', 'jpg', 'bmp', 'gif', 'jpeg', 'svg', 'tif', 'tiff') },
+        'audio' :
+            { 'size' : '+10k', 'match' : True, 'extensions' :
+                ('mp3', 'wma', 'ogg', 'wav', 'midi', 'aif') },
+        'video' :
+            { 'size' : '+500k','match' : True, 'extensions' :
+                ('avi', 'mkv', 'mpg', 'mpeg', 'h264', 'mov', 'mp4', 'vob', 'flv', '3gp', 'wmv') },
+        'certificate' :
+            { 'size' : '',   'match' : True, 'extensions' :
+                ('cer', 'crt', 'der', 'pem', 'crl') },
+        # TODO use zipfile.is_zipfile() and tarfile.is_tarfile() instead?
+        'archive' :
+            { 'size' : '',   'match' : True, 'extensions' :
+                ('7z', 'zip', 'gz', 'tgz', 'z', 'rar', 'rpm', 'pkg', 'deb') }
+    }
+
+    # Auto generate 'not-' / match=False entries
+    not_file_type_categories = dict()
+    file_type_choices = list()
+    for file_type_key, file_type_cat in file_type_categories.items():
+        file_type_choices += [ file_type_key ]
+        file_type_not_key = str('not-') + file_type_key
+        file_type_choices += [ file_type_not_key ]
+        not_file_type_categories[ file_type_not_key ] = dict(file_type_cat)
+        not_file_type_categories[ file_type_not_key ]['match'] = False
+    file_type_categories.update(not_file_type_categories)
+    return file_type_categories, file_type_choices
+
+
+_FILE_TYPE_CATEGORIES, _FILE_TYPE_CHOICES = _build_file_type_categories()
+
+# Marks prefixes that are shared by several category keys.
+_AMBIGUOUS_PREFIX = object()
+
+
+def _build_file_type_prefix_index(file_type_categories):
+    """ Maps every prefix of every category key to its full key, so an
+    abbreviated -f operand resolves with one dict lookup instead of a
+    linear startswith() scan over all keys. A prefix shared by several
+    keys maps to the _AMBIGUOUS_PREFIX sentinel.
+    """
+    prefix_index = dict()
+    for file_type_key in file_type_categories:
+        for end in range(1, len(file_type_key) + 1):
+            prefix = file_type_key[:end]
+            if prefix_index.get(prefix, file_type_key) != file_type_key:
+                prefix_index[prefix] = _AMBIGUOUS_PREFIX
+            else:
+                prefix_index[prefix] = file_type_key
+    return prefix_index
+
+
+_FILE_TYPE_PREFIX_INDEX = _build_file_type_prefix_index(_FILE_TYPE_CATEGORIES)
+
+# Placeholder that marks where the user's file pattern is spliced into a
+# prebuilt find expression.
+_PATTERN_PLACEHOLDER = '{PATTERN}'
+
+# Placeholder in the prune group for the search root, substituted per
+# path in invoke_command. See prepare_arguments_for_find.
+_ROOT_PLACEHOLDER = '{ROOT}'
+
+
+def _build_find_expressions(file_type_categories):
+    """ Precomputes the find name-filter argv for every single file-type
+    category, in both case modes, at import time. A -f call with one
+    category is the common case and then only needs to splice the file
+    pattern into the prebuilt tokens instead of rebuilding the regex
+    alternation from the extension list on every invocation.
+    """
+    expressions = dict()
+    for case_insensitive in ('', 'i'):
+        regex_test = '-' + case_insensitive + 'regex'
+        for file_type_key, file_type_cat in file_type_categories.items():
+            alternation = '|'.join(
+                re.escape(ext) for ext in file_type_cat['extensions'])
+            parts = ['-regextype', 'posix-extended', '(']
+            if not file_type_cat['match']:
+                parts.append('!')
+            parts += [regex_test, '(.*/)?' + _PATTERN_PLACEHOLDER +
+                      '\.(' + alternation + ')', ')']
+            expressions[(file_type_key, case_insensitive)] = parts
+    return expressions
+
+
+_PREBUILT_FIND_EXPR = _build_find_expressions(_FILE_TYPE_CATEGORIES)
 __email__   = 'real.norman.meinzer@gmail.com'
 __twitter__ = 'https://twitter.com/xor_man'
 __license__ = 'GPLv3'
@@ -67,22 +223,40 @@ class Search(object):
     def __init__(self):
         self.name = os.path.basename(sys.argv[0])
         self.grep_file_size_threshold = '-size -2000k '
+        self.file_type_categories = _FILE_TYPE_CATEGORIES
+        self.file_type_choices = _FILE_TYPE_CHOICES
+        # Feature probe for the --native content scanner, fastest engine
+        # first. An explicit --engine replaces this in parse_arguments.
+        if hyperscan is not None:
+            self.scanner = 'hyperscan'
+        elif re2 is not None:
+            self.scanner = 're2'
+        elif regex is not None:
+            self.scanner = 'regex'
+        else:
+            self.scanner = 're'
+        # Batch terminator for find's -exec: with '+' find appends as many
+        # file names as fit into one argument list and spawns grep once per
+        # batch (instead of one fork+exec per matching file with '\;').
+        self.grep_terminator = '+'
+        # Query the terminal width once for the --verbose separator
+        # banner. shutil reads TIOCGWINSZ with a single ioctl - no
+        # stty fork, no stderr noise when stdin is not a terminal.
+        self.terminal_columns = shutil.get_terminal_size((80, 24)).columns
         if platform.system() == 'Windows':
-            self.grep_terminator = ';'
             tmp = '~/' + os.path.splitext(self.name)[0]
             paths_config_root_path = os.path.expanduser(tmp)
-            if not os.path.exists(paths_config_root_path):
-                # Create the hidden config folder in ~
-                os.makedirs(paths_config_root_path)
-                import ctypes
-                ctypes.windll.kernel32.SetFileAttributesW(paths_config_root_path, 0x2)
+            # Create the hidden config folder in ~. exist_ok avoids the
+            # exists/makedirs race and the extra stat on every startup.
+            os.makedirs(paths_config_root_path, exist_ok=True)
+            import ctypes
+            ctypes.windll.kernel32.SetFileAttributesW(paths_config_root_path, 0x2)
             self.paths_config_path = paths_config_root_path + '/default-paths/'
+            self.index_db_path = paths_config_root_path + '/index.db'
         else:
-            self.grep_terminator = '\;'
-            self.paths_config_path = (
-                '~/.' +
-                os.path.splitext(self.name)[0] +
-                '/default-paths/')
+            config_root_path = '~/.' + os.path.splitext(self.name)[0]
+            self.paths_config_path = config_root_path + '/default-paths/'
+            self.index_db_path = config_root_path + '/index.db'
 
     def parse_arguments(self):
         """ Parse user input from the command line, define default settings for
@@ -146,6 +320,42 @@ class Search(object):
         parser.add_argument(
             '-s', '--show-command', action='store_true',
             help="Show generated command. Don't invoke it.")
+        parser.add_argument(
+            '--native', action='store_true',
+            help=dedent('''
+                Search in-process with os.scandir and mmap instead of
+                invoking find and grep. Avoids the process spawns,
+                which dominate on small and medium trees''')[1:])
+        parser.add_argument(
+            '--engine', action='store',
+            choices=['re', 'regex', 're2', 'hyperscan'],
+            help=dedent('''
+                Regex engine for the --native content scan. Default is
+                the fastest installed engine, probed in the order
+                hyperscan, re2, regex, re''')[1:])
+        parser.add_argument(
+            '--no-gitignore', action='store_true',
+            help=dedent('''
+                Don't honor .gitignore files during --native searches.
+                By default the native walker skips ignored files and
+                directories like generated build trees''')[1:])
+        parser.add_argument(
+            '--xargs-grep', action='store_true',
+            help=dedent('''
+                With --native, keep the pruned in-process walk but feed
+                the candidate files to one external grep (via xargs)
+                instead of scanning them in-process. Combines the
+                stat-free walk with grep's matcher and colored
+                output''')[1:])
+        parser.add_argument(
+            '--index', action='store_true',
+            help=dedent('''
+                Maintain a persistent trigram index for --native grep
+                searches. Repeated searches in the same tree then only
+                read files whose content can contain the pattern''')[1:])
+        parser.add_argument(
+            '--no-index', action='store_true',
+            help='Ignore the trigram index even if --index is configured')
         parser.add_argument(
             '-v', '--verbose', action='store_true',
             help='Print separator and generated command, then invoke it')
@@ -158,131 +368,159 @@ class Search(object):
             help=dedent('''
                 Last modified within the past [ Year, Quarter,
                 Month, Week, Day(24h), Today(12h) ]''')[1:])
+        parser.add_argument(
+            '--skip-dir', action='append', metavar='DIR',
+            help=dedent('''
+                Prune directories named DIR from the search. May be
+                passed multiple times. Extends the default prune list
+                {}'''.format(sorted(DEFAULT_SKIP_DIRS)))[1:])
+        parser.add_argument(
+            '--no-default-skip', action='store_true',
+            help="Don't prune the default directory list (see --skip-dir)")
+        parser.add_argument(
+            '-x', '--xdev', action='store_true',
+            help="Don't descend directories on other file systems")
+        parser.add_argument(
+            '-j', '--jobs', action='store', type=int, default=1,
+            help=dedent('''
+                Number of search paths from -d to process in parallel.
+                Default is 1, which preserves the output order of the
+                configured paths''')[1:])
+        parser.add_argument(
+            '-1', '--first-match-only', action='store_true',
+            help=dedent('''
+                Stop reading a file after the first `grep` match.
+                Speeds up searches in large files considerably''')[1:])
+        parser.add_argument(
+            '--files-with-matches', action='store_true',
+            help=dedent('''
+                Only print the names of files that contain a `grep`
+                match. Implies that grep stops reading a file after
+                the first match''')[1:])
         parser.add_argument(
             '-c', '--case-sensitive',
             action='store_true',
             help='Case sensitive search for `find` (and `grep`)')
+        parser.add_argument(
+            '-u', '--utf8', action='store_true',
+            help=dedent('''
+                Run `find` and `grep` with the user's locale instead of
+                the faster C locale. Required for non-ASCII search
+                patterns. Without this switch, case-insensitive
+                matching is ASCII-only.''')[1:])
         self.args = parser.parse_args()
-
-        self.args.search_path = self.args.search_path.replace('"', '\\"')
-        self.args.file_pattern = self.args.file_pattern.replace('"', '\\"')
-        if self.args.grep:
-            self.args.grep = self.args.grep.replace('"', '\\"')
-
-        if not self.args.case_sensitive:
-            self.case_insensitive = 'i'
-        else:
-            self.case_insensitive = ''
+        self.case_insensitive = 'i' if not self.args.case_sensitive else ''
+        if self.args.engine:
+            engines = {'hyperscan': hyperscan, 're2': re2,
+                       'regex': regex, 're': re}
+            if engines[self.args.engine] is None:
+                print("Error: Engine '" + self.args.engine +
+                      "' is not installed")
+                exit(1)
+            self.scanner = self.args.engine
 
     def prepare_arguments_for_find(self):
-        """ Prepare the options that are passed to the find executable. """
-        self.find_arg = '-not -path \'*/.git/*\' '
+        """ Prepare the options that are passed to the find executable.
+        The options are collected as a list of argv tokens, so no shell
+        quoting or escaping is involved at any point.
+        """
+        self.find_arg = []
+        if self.args.xdev:
+            self.find_arg.append('-xdev')
+        # Directory pruning -------------------
+        # Emitted as ( -type d ( -name a -o -name b ) -prune ) -o ( ...
+        # so find never descends into the skipped directories. The closing
+        # ) with the -print / -exec action is appended in invoke_command.
+        skip_dirs = [] if self.args.no_default_skip else sorted(DEFAULT_SKIP_DIRS)
+        if self.args.skip_dir:
+            skip_dirs += self.args.skip_dir
+        if skip_dirs:
+            # find applies the expression to the start point itself, so
+            # the prune test must exclude the root - otherwise a search
+            # rooted in a directory named e.g. 'build' returns nothing.
+            # walk_scandir gets this right for free by only testing
+            # children.
+            self.find_arg += ['(', '-type', 'd', '!', '-path',
+                              _ROOT_PLACEHOLDER, '(', '-name', skip_dirs[0]]
+            for skip_dir in skip_dirs[1:]:
+                self.find_arg += ['-o', '-name', skip_dir]
+            self.find_arg += [')', '-prune', ')', '-o', '(']
+        else:
+            self.find_arg.append('(')
         # File types / names ------------------
         if self.args.file_type:
             # Search for one or more categories of file types.
             # Categories can be text, image, audio OR not-text.
-            self.create_file_type_categories()
-
             file_type_cats = self.find_file_type_cat_or_exit()
+            file_type_key = _FILE_TYPE_PREFIX_INDEX.get(self.args.file_type)
+            if (len(file_type_cats) == 1 and file_type_key is not None and
+                    file_type_key is not _AMBIGUOUS_PREFIX):
+                # Common case: one unambiguous category. Splice the file
+                # pattern into the expression prebuilt at import time.
+                pattern_regex = glob_to_posix_regex(self.args.file_pattern)
+                self.find_arg += [
+                    token.replace(_PATTERN_PLACEHOLDER, pattern_regex)
+                    for token in
+                    _PREBUILT_FIND_EXPR[(file_type_key, self.case_insensitive)]]
+            else:
+                self.add_file_ext_filter(file_type_cats, self.args.file_pattern)
             if len(file_type_cats) == 1 and file_type_cats[0]['size'] != '':
                 # `find` only takes one -size argument. Therefore,
                 # it is only passed if the user searches one of our
                 # file type categories.
-                self.find_arg += '-size ' + file_type_cats[0]['size'] + ' '
-            self.add_file_ext_filter(file_type_cats, self.args.file_pattern)
+                self.find_arg += ['-size', file_type_cats[0]['size']]
         else:
             # Search for one file pattern (e.g. *.py)
-            self.find_arg += ('-' + self.case_insensitive +
-                'name \'' + self.args.file_pattern + '\' ')
-            #if self.args.regex:
-            #    self.find_arg += ('-regextype "posix-extended" -' +
-            #        self.case_insensitive +
-            #        'regex \'' + self.args.file_pattern + '\' ')
-            #else:
-            #    self.find_arg += ('-' + self.case_insensitive +
-            #        'name \'' + self.args.file_pattern + '\' ')
+            self.find_arg += ['-' + self.case_insensitive + 'name',
+                              self.args.file_pattern]
+
+        # Predicate ordering: the name tests above match on dirent data
+        # and need no metadata; -type, -size and -mtime each force a
+        # stat() per candidate. Keeping the name tests first prunes most
+        # entries before find issues a single stat call.
+        if self.args.grep:
+            self.find_arg += ['-type', 'f']
+            if '-size' not in self.find_arg:
+                # If grep is used, ensure that a file '-size' limit is set. This
+                # prevents that time is wasted for a pattern search in big files
+                # that are often compressed or encrypted archives.
+                self.find_arg += self.grep_file_size_threshold.split()
 
         # Time --------------------------------
         if self.args.last_modified:
            self.add_time_filter()
 
     def prepare_arguments_for_grep(self):
-        """ Prepare the options that are passed to the grep executable. """
-        self.grep_arg = '-exec grep --color=always '
-        self.grep_arg += '--with-filename --line-number '
+        """ Prepare the options that are passed to the grep executable,
+        as a list of argv tokens like prepare_arguments_for_find.
+        """
+        # Note: grep's historic --mmap switch is deliberately not passed
+        # here. GNU grep turned it into a no-op in 2.6 and removed it
+        # later, so current greps reject it (verified with grep 3.8).
+        # The batching via the '+' exec terminator is what actually cuts
+        # the per-file cost; see grep_terminator in __init__.
+        self.grep_arg = ['-exec', 'grep', '--color=always',
+                         '--with-filename', '--line-number']
+        if self.args.files_with_matches:
+            # grep already stops reading a file after the first hit
+            # under --files-with-matches, so -m 1 is not needed here.
+            self.grep_arg.append('--files-with-matches')
+        elif self.args.first_match_only:
+            self.grep_arg += ['-m', '1']
         if self.args.more_context is not None:
-            self.grep_arg += '--before-context=' + self.args.more_context + ' '
-            self.grep_arg += '--after-context=' + self.args.more_context + ' '
+            self.grep_arg.append('--before-context=' + self.args.more_context)
+            self.grep_arg.append('--after-context=' + self.args.more_context)
 
     def prepare_list_of_paths_to_search_in(self):
         """ Prepares the paths in which `find` will search. """
         if self.args.default_path_file is not None:
             # `find` will be invoked for each path
             self.parse_default_paths_from_file( self.args.default_path_file )
+            self.paths = dedup_roots(self.paths)
         else:
             # `find` will be invoked once
             self.paths = [ self.args.search_path ]
 
-    def create_file_type_categories(self):
-        """ This is an embedded configuration of file_type categories.
-
-        A file_type category consists of size, the match-flag, and extensions.
-        - size : Optional criteria to reduce the number of file findings
-                 through the file size.
-        - match: True  --> Find files that match the extensions
-                 False --> Find files that don't match the extensions.
-                           These entries are automatically generated.
-        - extensions: Mandatory list of file extensions to search for.
-        """
-        # TODO too many matches with 'import mimetypes'?
-        self.file_type_categories = {
-            'text' :
-                { 'size' : '', 'match' : True, 'extensions' :
-                    ('txt', 'md', 'markdown', 'csv', 'url') },
-            'markup-text' :
-                { 'size' : '', 'match' : True, 'extensions' :
-                    ('tex', 'htm', 'html', 'rtf') },
-            'code' :
-                { 'size' : '', 'match' : True, 'extensions' :
-                    ('c', 'cpp', 'cc', 'h', 'hpp', 'java', 'swift', 'php', 'rb', 'el', 'lsp', 'm', 'cp') },
-            'configuration' :
-                { 'size' : '', 'match' : True, 'extensions' :
-                    ('cfg', 'reg', 'yaml', 'ini', 'xml', 'json') },
-            'script' :
-                { 'size' : '', 'match' : True, 'extensions' :
-                    ('sh', 'py', 'pl', 'mk', 'mak', 'cmake', 'bat', 'ps1', 'vb', 'vbs', 'ws', 'scpt', 'command', 'tcl', 'vim', 'r', 'lua') },
-            #'' :
-                #{ 'size' : '', 'match' : True, 'extensions' : ( '', '' ) },
-            'image' :
-                { 'size' : '+4k',  'match' : True, 'extensions' :
-                    ('png', 'jpg', 'bmp', 'gif', 'jpeg', 'svg', 'tif', 'tiff') },
-            'audio' :
-                { 'size' : '+10k', 'match' : True, 'extensions' :
-                    ('mp3', 'wma', 'ogg', 'wav', 'midi', 'aif') },
-            'video' :
-                { 'size' : '+500k','match' : True, 'extensions' :
-                    ('avi', 'mkv', 'mpg', 'mpeg', 'h264', 'mov', 'mp4', 'vob', 'flv', '3gp', 'wmv') },
-            'certificate' :
-                { 'size' : '',   'match' : True, 'extensions' :
-                    ('cer', 'crt', 'der', 'pem', 'crl') },
-            # TODO use zipfile.is_zipfile() and tarfile.is_tarfile() instead?
-            'archive' :
-                { 'size' : '',   'match' : True, 'extensions' :
-                    ('7z', 'zip', 'gz', 'tgz', 'z', 'rar', 'rpm', 'pkg', 'deb') }
-        }
-
-        # Auto generate 'not-' / match=False entries
-        not_file_type_categories = dict()
-        self.file_type_choices = list()
-        for file_type_key, file_type_cat in self.file_type_categories.items():
-            self.file_type_choices += [ file_type_key ]
-            if not file_type_key.startswith('not-'):
-                file_type_not_key = str('not-') + file_type_key
-                self.file_type_choices += [ file_type_not_key ]
-                not_file_type_categories[ file_type_not_key ] = dict(file_type_cat)
-                not_file_type_categories[ file_type_not_key ]['match'] = False
-        self.file_type_categories.update(not_file_type_categories)
-
     def find_file_type_cat_or_exit(self):
         """ Parses the -f command line argument operand and tries to
         find the internal definition of the requested type. Prints a
@@ -292,10 +530,19 @@ class Search(object):
         file_type_cats = []
         for file_type in self.args.file_type.split(','):
             file_type_cat = False
-            for file_type_key in self.file_type_categories:
-                if file_type_key.startswith(file_type):
-                    file_type_cat = self.file_type_categories[ file_type_key ]
-                    break
+            file_type_key = _FILE_TYPE_PREFIX_INDEX.get(file_type)
+            if file_type_key is _AMBIGUOUS_PREFIX:
+                # Several categories share this prefix. Resolving it
+                # silently to one of them surprises; make the user
+                # disambiguate instead.
+                sys.stdout.write("Error: Ambiguous file-type '" +
+                                 file_type +
+                                 "'; matches: ")
+                print(sorted(key for key in self.file_type_categories
+                             if key.startswith(file_type)))
+                exit(1)
+            elif file_type_key is not None:
+                file_type_cat = self.file_type_categories[ file_type_key ]
 
             if file_type_cat:
                 file_type_cats.append(file_type_cat)
@@ -310,29 +557,28 @@ class Search(object):
     def add_file_ext_filter(self, file_type_categories, file_pattern):
         """ Reduce the number of file findings by searching for a specific
         'file_pattern' (wildcards supported) and 'file_type_categories'.
+        Each category is collapsed into one posix-extended -regex
+        alternation, so `find` evaluates a single compiled regex per
+        directory entry instead of one fnmatch call per extension.
         """
-        self.find_arg += '\( '
+        regex_test = '-' + self.case_insensitive + 'regex'
+        pattern_regex = glob_to_posix_regex(file_pattern)
+        parts = ['-regextype', 'posix-extended', '(']
         first_type = True
         for file_type_category in file_type_categories:
-            extensions = file_type_category['extensions']
+            if not first_type:
+                parts.append('-o')
+            alternation = '|'.join(
+                re.escape(ext) for ext in file_type_category['extensions'])
             if file_type_category['match'] == False:
-                if not first_type:
-                    self.find_arg += '-o '
-                self.find_arg += '-not -' + self.case_insensitive + 'name \'' + \
-                                 file_pattern + '.' + extensions[0] + '\' '
-                for ext in extensions[1:]:
-                    self.find_arg += '-a -not -' + self.case_insensitive + 'name \'' + \
-                                     file_pattern + '.' + ext + '\' '
-            else:
-                if not first_type:
-                    self.find_arg += '-o '
-                self.find_arg += '-' + self.case_insensitive + 'name \'' + \
-                                 file_pattern + '.' + extensions[0] + '\' '
-                for ext in extensions[1:]:
-                    self.find_arg += '-o -' + self.case_insensitive + 'name \'' + \
-                                  file_pattern + '.' + ext + '\' '
+                parts.append('!')
+            # -regex matches the whole path, therefore the basename
+            # pattern is prefixed with an optional directory part.
+            parts += [regex_test,
+                      '(.*/)?' + pattern_regex + '\.(' + alternation + ')']
             first_type = False
-        self.find_arg += ' \) '
+        parts.append(')')
+        self.find_arg += parts
 
     def add_time_filter(self):
         """ Reduce the number of file findings by searching for files that
@@ -340,12 +586,12 @@ class Search(object):
         argument that is stored in a member of the class.
         """
         lm_dict = {
-            'y': '-mtime -365 ',
-            'q': '-mtime -90 ',
-            'm': '-mtime -30 ',
-            'w': '-mtime -7 ',
-            'd': '-mtime -1 ',
-            't': '-mmin -720 ' # 720 minutes ago = 12 hours
+            'y': ['-mtime', '-365'],
+            'q': ['-mtime', '-90'],
+            'm': ['-mtime', '-30'],
+            'w': ['-mtime', '-7'],
+            'd': ['-mtime', '-1'],
+            't': ['-mmin', '-720'] # 720 minutes ago = 12 hours
         }
         # Input is already validated by argparser choices
         self.find_arg += lm_dict[ self.args.last_modified ]
@@ -364,110 +610,718 @@ class Search(object):
         self.paths = list()
         file_name = os.path.expanduser(self.paths_config_path) + id + '.txt'
         try:
-            tmp_file = open(file_name)
-            for path in tmp_file:
-                path_to_add = path.rstrip().replace('"', '\\"')
-                path_to_add = os.path.expanduser( path_to_add )
-                self.paths += [ path_to_add ]
-        except:
-            print('Configuration file ' + file_name + ' does not exist.')
-            if dialog_yes_no('Do you want to create it?', 'no'):
-                try:
-                    if not os.path.exists( os.path.dirname(file_name) ):
-                        os.makedirs( os.path.dirname(file_name) )
-                    tmp_file = open(file_name, 'w')
-                    print('Please enter one path, then press enter. '
-                          'Enter empty line to exit.')
+            # Read the file in one go instead of looping line by line;
+            # the context manager closes the fd promptly even on errors.
+            with open(file_name, 'rb') as tmp_file:
+                data = tmp_file.read()
+            # The paths go into an argv list verbatim - no shell ever
+            # parses them, so no quoting or escaping is needed here.
+            # os.fsdecode round-trips non-UTF-8 path bytes the same way
+            # the os module itself does instead of raising.
+            self.paths = [
+                _expanduser( os.fsdecode(line).rstrip() )
+                for line in data.splitlines() if line.strip() ]
+        except FileNotFoundError:
+            self.create_default_paths_file_dialog(id, file_name)
+        except OSError as error:
+            # E.g. PermissionError; offering to create the file would
+            # only fail again, so just report it.
+            print('Cannot read configuration file: ' + str(error))
+
+    def create_default_paths_file_dialog(self, id, file_name):
+        """ Asks the user to create the default-paths config file
+        'file_name' interactively. One path per entered line; an empty
+        line finishes the file.
+        """
+        print('Configuration file ' + file_name + ' does not exist.')
+        if dialog_yes_no('Do you want to create it?', 'no'):
+            try:
+                os.makedirs( os.path.dirname(file_name), exist_ok=True )
+                # 'x' instead of 'w': if the file appeared since the
+                # failed read, never truncate it.
+                tmp_file = open(file_name, 'x')
+                print('Please enter one path, then press enter. '
+                      'Enter empty line to exit.')
+                new_path = input()
+                while new_path != '':
+                    tmp_file.write(new_path)
                     new_path = input()
-                    while new_path != '':
-                        tmp_file.write(new_path)
-                        new_path = input()
-                        if new_path != '':
-                            tmp_file.write('\n')
-                except:
-                    print('Cannot open file for writing')
+                    if new_path != '':
+                        tmp_file.write('\n')
+            except FileExistsError:
+                print('Configuration file was created in the meantime; '
+                      'keeping it.')
+            except OSError as error:
+                print('Cannot open file for writing: ' + str(error))
 
     def invoke_command(self):
-        """ Assembles and invokes the final command. """
+        """ Assembles the final command for each path and invokes the
+        commands, either one after another or -j commands in parallel.
+        """
+        if self.args.native and not self.args.show_command:
+            self.invoke_native_search()
+            return
+        # Everything after the search path is the same for every path,
+        # so the tail is assembled once and each -d iteration reduces to
+        # one list concatenation.
+        tail = list(self.find_arg)
+        if self.args.grep:
+            tail += self.grep_arg
+            if not self.args.case_sensitive:
+                tail.append('--ignore-case')
+            # -e protects patterns that start with a dash from being
+            # parsed as grep options.
+            tail += ['-e', self.args.grep, '{}', self.grep_terminator, ')']
+        else:
+            tail += ['-print', ')']
+            if self.args.more_context is not None:
+                print('Warning: Option -m,--more-context is only '
+                      'effective in combination with -g')
+        commands = []
         for path in self.paths:
-            command='find \'' + path + '\' ' + self.find_arg
-
-            if self.args.grep:
-                command += ' -type f '
-                if not '-size' in command:
-                    # If grep is used, ensure that a file '-size' limit is set. This
-                    # prevents that time is wasted for a pattern search in big files
-                    # that are often compressed or encrypted archives.
-                    command += self.grep_file_size_threshold
-
-                command += self.grep_arg
-                if not self.args.case_sensitive:
-                    command += '--ignore-case '
-                command += ('\'' + self.args.grep + '\'' +
-                            ' {} ' + self.grep_terminator)
-            else:
-                if self.args.more_context is not None:
-                    print('Warning: Option -m,--more-context is only '
-                          'effective in combination with -g')
+            # Per path only the root placeholder in the prune group
+            # needs substituting; see prepare_arguments_for_find.
+            argv = ['find', path] + [
+                path if token == _ROOT_PLACEHOLDER else token
+                for token in tail ]
             if self.args.verbose:
-                terminal_rows, terminal_columns = (
-                    os.popen('stty size', 'r').read().split())
-                print( '#' * int(terminal_columns) )
+                print( '#' * self.terminal_columns )
             if self.args.verbose or self.args.show_command:
-                print(command)
+                # Quote the argv tokens so the printed command can be
+                # pasted into (or redirected to) a shell unchanged.
+                print(' '.join(shlex.quote(token) for token in argv))
             if not self.args.show_command:
+                commands.append(argv)
+
+        if (len(commands) == 1 and not self.args.verbose and
+                platform.system() != 'Windows'):
+            # Single search without banner output: replace this process
+            # with find instead of pumping the child's output through a
+            # pipe. The terminal fd is handed straight to find/grep, so
+            # every output byte is written once instead of twice.
+            argv = commands[0]
+            if self.args.utf8:
+                env = os.environ
+            else:
+                env = dict(os.environ, LC_ALL='C', LANG='C')
+            sys.stdout.flush()
+            os.execvpe(argv[0], argv, env)
+
+        if self.args.jobs > 1 and len(commands) > 1:
+            # Each search buffers its complete output and is written in
+            # one piece when it finishes, so the findings of different
+            # paths never interleave. The workers only pump pipes of
+            # I/O-bound find/grep children, so -j is not capped at the
+            # CPU count (which os.cpu_count may not even know).
+            max_workers = min(len(commands), self.args.jobs)
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = [
+                    executor.submit(execute_and_return_stdout,
+                                    command, self.args.utf8)
+                    for command in commands ]
+                for future in as_completed(futures):
+                    sys.stdout.buffer.write(future.result())
+            sys.stdout.buffer.flush()
+        else:
+            for command in commands:
                 #print( os.popen(command).read() )
-                execute_and_print_stdout_while_running(command)
+                execute_and_print_stdout_while_running(command, self.args.utf8)
+
+
+    def invoke_native_search(self):
+        """ Searches the file system in-process instead of invoking find
+        and grep. The walk consumes the file type that os.scandir reads
+        from the directory itself, so listing searches need no stat()
+        at all, and file content is scanned through an mmap with one
+        pattern that is compiled once.
+        """
+        skip_dirs = set() if self.args.no_default_skip else set(DEFAULT_SKIP_DIRS)
+        if self.args.skip_dir:
+            skip_dirs.update(self.args.skip_dir)
+        self.prepare_native_name_filter()
+
+        pattern = None
+        max_size = None
+        if self.args.grep:
+            pattern = self.compile_native_pattern()
+            # Same limit the generated find command applies through
+            # grep_file_size_threshold (-size -2000k).
+            max_size = 2000 * 1024
+        mtime_cutoff = None
+        if self.args.last_modified:
+            # Same windows add_time_filter passes to find as -mtime/-mmin.
+            lm_days = {'y': 365, 'q': 90, 'm': 30, 'w': 7, 'd': 1, 't': 0.5}
+            mtime_cutoff = (time.time() -
+                            lm_days[self.args.last_modified] * 86400)
+        if self.args.more_context is not None:
+            print('Warning: Option --more-context'
+                  ' is not supported in combination with --native')
+
+        index = None
+        query_bits = 0
+        if self.args.index and not self.args.no_index and pattern is not None:
+            index = TrigramIndex(os.path.expanduser(self.index_db_path))
+            query_bits = TrigramIndex.pattern_bits(self.args.grep)
+        xargs_process = None
+        if pattern is not None and self.args.xargs_grep:
+            xargs_process = self.spawn_xargs_grep()
+            feed = bytearray()
+
+        honor_gitignore = not self.args.no_gitignore
+        for path in self.paths:
+            for entry in walk_scandir(path, skip_dirs, honor_gitignore):
+                if not self.native_name_matches(entry.name):
+                    continue
+                if max_size is not None or mtime_cutoff is not None:
+                    # One stat per candidate serves both the size and the
+                    # mtime filter; DirEntry caches the result anyway.
+                    try:
+                        stat_result = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    if (max_size is not None and
+                            stat_result.st_size >= max_size):
+                        continue
+                    if (mtime_cutoff is not None and
+                            stat_result.st_mtime < mtime_cutoff):
+                        continue
+                if pattern is None:
+                    print(entry.path)
+                    continue
+                if index is not None and index.can_skip(entry.path,
+                                                        stat_result,
+                                                        query_bits):
+                    continue
+                if xargs_process is not None:
+                    # Collect the candidates into 64 KiB stdin writes
+                    # instead of one syscall per path.
+                    feed += entry.path.encode() + b'\0'
+                    if len(feed) >= 65536:
+                        try:
+                            xargs_process.stdin.write(feed)
+                        except BrokenPipeError:
+                            break
+                        feed.clear()
+                else:
+                    self.native_grep_file(entry.path, pattern)
+        if xargs_process is not None:
+            try:
+                if feed:
+                    xargs_process.stdin.write(feed)
+                xargs_process.stdin.close()
+            except BrokenPipeError:
+                pass
+            xargs_process.wait()
+        if index is not None:
+            index.close()
+
+    def spawn_xargs_grep(self):
+        """ Launches the single grep coprocess for --xargs-grep. xargs
+        takes care of ARG_MAX batching, so grep is started once per
+        tens of thousands of candidates rather than per find -exec
+        batch. The candidate paths are written NUL-separated to the
+        returned process's stdin; grep inherits stdout, so its colored
+        output goes straight to the terminal.
+        """
+        # grep_arg holds ['-exec', 'grep', <options>]; reuse everything
+        # from 'grep' on so the option handling stays in one place.
+        argv = ['xargs', '-0', '-r'] + self.grep_arg[1:]
+        if not self.args.case_sensitive:
+            argv.append('--ignore-case')
+        argv += ['-e', self.args.grep]
+        if self.args.utf8:
+            env = None
+        else:
+            env = dict(os.environ, LC_ALL='C', LANG='C')
+        return subprocess.Popen(argv, stdin=subprocess.PIPE, env=env)
+
+    def compile_native_pattern(self):
+        """ Compiles the --grep pattern once for the native scan path,
+        using the fastest regex engine found by the feature probe in
+        __init__. Every engine is wrapped behind the finditer protocol
+        that native_grep_file consumes. Falls back to the stdlib re
+        module if the accelerated engine rejects the pattern.
+        """
+        pattern_bytes = self.args.grep.encode()
+        # Literal patterns allow a cheap prefilter in native_grep_file:
+        # one content.find() call (SIMD-backed in CPython) decides
+        # whether the regex engine needs to run at all. Only safe when
+        # case doesn't matter for the comparison, i.e. for case
+        # sensitive searches or patterns without letters.
+        self.native_literal = None
+        if re.escape(self.args.grep) == self.args.grep:
+            if self.args.case_sensitive or not re.search(
+                    '[A-Za-z]', self.args.grep):
+                self.native_literal = pattern_bytes
+        if self.scanner == 'hyperscan':
+            try:
+                return HyperscanPattern(pattern_bytes,
+                                        not self.args.case_sensitive)
+            except hyperscan.error:
+                pass
+        flags = 0 if self.args.case_sensitive else re.IGNORECASE
+        if self.scanner == 're2':
+            try:
+                return re2.compile(pattern_bytes, flags)
+            except re2.error:
+                pass
+        if self.scanner == 'regex':
+            # V1 enables the module's newer matching behavior; the flag
+            # constants are shared with the stdlib re module.
+            try:
+                return regex.compile(pattern_bytes, regex.V1 | flags)
+            except regex.error:
+                pass
+        return re.compile(pattern_bytes, flags)
+
+    def prepare_native_name_filter(self):
+        """ Derives the name filter sets for the native search from the
+        -f argument, mirroring what add_file_ext_filter emits for find:
+        extensions of regular categories are collected in an include
+        set, extensions of not-* categories in an exclude set.
+        """
+        self.include_exts = self.exclude_exts = None
+        if self.args.file_type:
+            include_exts = set()
+            exclude_exts = set()
+            for file_type_cat in self.find_file_type_cat_or_exit():
+                if file_type_cat['match']:
+                    include_exts.update(file_type_cat['extensions'])
+                else:
+                    exclude_exts.update(file_type_cat['extensions'])
+            self.include_exts = include_exts or None
+            self.exclude_exts = exclude_exts or None
+        self.native_file_pattern = self.args.file_pattern
+        if not self.args.case_sensitive:
+            self.native_file_pattern = self.native_file_pattern.lower()
+        # Fast path: with the default '*' pattern the stem part always
+        # matches, so a candidate is decided by one set membership test
+        # on its extension - no fnmatch, no lowercased copy of the name.
+        self.native_ext_only = (self.native_file_pattern == '*' and
+                                self.include_exts is not None and
+                                self.exclude_exts is None)
+
+    def native_name_matches(self, name):
+        """ Applies the file_pattern and -f filters to a file 'name'.
+        Categories are ORed like in the generated find expression;
+        not-* categories match everything outside their extension list.
+        """
+        if self.native_ext_only:
+            stem, sep, ext = name.rpartition('.')
+            if not self.args.case_sensitive:
+                ext = ext.lower()
+            return sep != '' and ext in self.include_exts
+        if not self.args.case_sensitive:
+            name = name.lower()
+        if self.include_exts is None and self.exclude_exts is None:
+            return fnmatch.fnmatchcase(name, self.native_file_pattern)
+        stem, sep, ext = name.rpartition('.')
+        pattern_hit = (sep != '' and
+                       fnmatch.fnmatchcase(stem, self.native_file_pattern))
+        if self.include_exts is not None:
+            if pattern_hit and ext in self.include_exts:
+                return True
+        if self.exclude_exts is not None:
+            if not (pattern_hit and ext in self.exclude_exts):
+                return True
+        return False
+
+    def native_grep_file(self, file_path, pattern):
+        """ Scans one file for 'pattern' through an mmap and prints
+        grep-style 'path:lineno:line' output. Files that look binary
+        (NUL byte within the first 8 KiB) are skipped silently. Line
+        numbers are counted lazily between matches, so files without a
+        match never have their bytes copied into Python.
+        """
+        try:
+            with open(file_path, 'rb') as tmp_file:
+                fd = tmp_file.fileno()
+                if hasattr(os, 'posix_fadvise'):
+                    # Declare the access pattern on the descriptor, too:
+                    # sequential readahead while scanning. The scanned
+                    # pages stay cached on purpose - repeated searches
+                    # over the same tree are the common case and served
+                    # from the page cache. Not available on macOS.
+                    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                try:
+                    content = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+                except ValueError:
+                    return # Empty file
+                with content:
+                    if hasattr(content, 'madvise'):
+                        # Tell the kernel the mapping is read front to
+                        # back so it raises readahead; not available on
+                        # all platforms.
+                        content.madvise(mmap.MADV_SEQUENTIAL)
+                    if b'\0' in content[:8192]:
+                        return
+                    if (self.native_literal is not None and
+                            content.find(self.native_literal) < 0):
+                        # Prefilter only - a hit still goes through the
+                        # regular line-extraction path below.
+                        return
+                    out = sys.stdout.buffer
+                    line_number = 1
+                    counted_until = 0
+                    last_line_start = -1
+                    for match in pattern.finditer(content):
+                        line_start = content.rfind(b'\n', 0, match.start()) + 1
+                        if line_start == last_line_start:
+                            # grep prints a matching line only once
+                            continue
+                        last_line_start = line_start
+                        line_end = content.find(b'\n', match.start())
+                        if line_end == -1:
+                            line_end = len(content)
+                        line_number += content[counted_until:line_start].count(b'\n')
+                        counted_until = line_start
+                        if self.args.files_with_matches:
+                            print(file_path)
+                            return
+                        out.write(file_path.encode() + b':' +
+                                  str(line_number).encode() + b':' +
+                                  content[line_start:line_end] + b'\n')
+                        if self.args.first_match_only:
+                            break
+                    out.flush()
+        except OSError:
+            return
+
+
+class HyperscanPattern(object):
+    """ Adapter that exposes a hyperscan block-mode database through the
+    subset of the re pattern protocol that native_grep_file consumes
+    (finditer yielding objects with start() and end()).
+    """
+    class Match(object):
+        def __init__(self, start, end):
+            self._start = start
+            self._end = end
+        def start(self):
+            return self._start
+        def end(self):
+            return self._end
+
+    def __init__(self, pattern_bytes, caseless):
+        flags = hyperscan.HS_FLAG_SOM_LEFTMOST
+        if caseless:
+            flags |= hyperscan.HS_FLAG_CASELESS
+        self.database = hyperscan.Database()
+        self.database.compile(expressions=[pattern_bytes], flags=[flags])
+
+    def finditer(self, content):
+        # hyperscan reports matches through a callback. Collect them and
+        # hand back a plain iterator; the callback order is by match end
+        # offset, which preserves the line order of the findings.
+        matches = []
+        def on_match(match_id, start, end, flags, context):
+            matches.append(HyperscanPattern.Match(start, end))
+        try:
+            self.database.scan(content, match_event_handler=on_match)
+        except TypeError:
+            # Older bindings only take bytes, not a buffer/mmap
+            self.database.scan(bytes(content), match_event_handler=on_match)
+        return iter(matches)
+
+
+class TrigramIndex(object):
+    """ Persistent trigram index for repeated --native grep searches.
+
+    For every scanned file a 16384-bit set of hashed content trigrams is
+    stored in a sqlite database, together with mtime and size for
+    invalidation. Before a file is opened during a search, the trigrams
+    of a literal pattern are tested against the file's stored bitset; if
+    a required trigram is missing, the file cannot contain the pattern
+    and is skipped without reading a byte of its content. The filter
+    can produce false positives (hash collisions) but never false
+    negatives, so skipping is always safe. On repeated searches in an
+    unchanged tree only a handful of candidate files remain to be read.
+    """
+    BITS = 16384
 
+    def __init__(self, db_path):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.connection = sqlite3.connect(db_path)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS files '
+            '(path TEXT PRIMARY KEY, mtime REAL, size INT, trigrams BLOB)')
+        self.dirty = False
 
-def execute_and_print_stdout_while_running(command):
-    """ Executes a shell 'command' and prints the standard
-    output of the subprocess while it is running. Returns
+    def can_skip(self, path, stat_result, query_bits):
+        """ Returns True if the indexed trigrams of 'path' prove that
+        its content cannot contain the query. The file's bitset is
+        recomputed and stored when its mtime or size changed since it
+        was indexed.
+        """
+        file_bits = self.lookup(path, stat_result)
+        if file_bits is None:
+            file_bits = self.update(path, stat_result)
+            if file_bits is None:
+                return False
+        return query_bits & file_bits != query_bits
+
+    def lookup(self, path, stat_result):
+        """ Returns the stored bitset of 'path', or None if the file is
+        not indexed or changed since it was indexed.
+        """
+        row = self.connection.execute(
+            'SELECT mtime, size, trigrams FROM files WHERE path = ?',
+            (path,)).fetchone()
+        if (row is None or row[0] != stat_result.st_mtime or
+                row[1] != stat_result.st_size):
+            return None
+        return int.from_bytes(row[2], 'little')
+
+    def update(self, path, stat_result):
+        """ Recomputes and stores the bitset of 'path'. Returns the new
+        bitset, or None if the file could not be read.
+        """
+        try:
+            with open(path, 'rb') as tmp_file:
+                data = tmp_file.read()
+        except OSError:
+            return None
+        bits = self.trigram_bits(data.lower())
+        self.connection.execute(
+            'INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)',
+            (path, stat_result.st_mtime, stat_result.st_size,
+             bits.to_bytes(self.BITS // 8, 'little')))
+        self.dirty = True
+        return bits
+
+    @staticmethod
+    def trigram_bits(data):
+        """ Folds every byte trigram of 'data' into one integer bitset. """
+        bits = 0
+        for byte_1, byte_2, byte_3 in set(zip(data, data[1:], data[2:])):
+            trigram = byte_1 << 16 | byte_2 << 8 | byte_3
+            bits |= 1 << (trigram % TrigramIndex.BITS)
+        return bits
+
+    @staticmethod
+    def pattern_bits(pattern):
+        """ Returns the bitset of trigrams that every file matching
+        'pattern' must contain. Only pure literal patterns contribute
+        trigrams; for a regex pattern the filter stays empty and no
+        file is skipped. Content and pattern are both indexed
+        lowercased, which keeps the filter safe for case-insensitive
+        searches too.
+        """
+        if re.escape(pattern) != pattern:
+            return 0
+        return TrigramIndex.trigram_bits(pattern.encode().lower())
+
+    def close(self):
+        if self.dirty:
+            self.connection.commit()
+        self.connection.close()
+
+
+# Cached front ends for the path normalization calls. expanduser walks
+# passwd lookups and realpath chains lstat calls; a default-paths config
+# frequently repeats path prefixes, and within one invocation the
+# results cannot go stale.
+_expanduser = lru_cache(maxsize=None)(os.path.expanduser)
+_realpath = lru_cache(maxsize=None)(os.path.realpath)
+
+
+def dedup_roots(paths):
+    """ Resolves the search 'paths' with realpath and drops duplicates
+    and roots that are nested inside another root. A config that lists
+    both ~/src and ~/src/project would otherwise walk the nested tree
+    twice and print its findings twice. Returns the surviving roots in
+    sorted order.
+    """
+    roots = []
+    for path in sorted(_realpath(path) for path in paths):
+        if roots and (path == roots[-1] or
+                      path.startswith(roots[-1] + os.sep)):
+            continue
+        roots.append(path)
+    return roots
+
+
+class GitignoreMatcher(object):
+    """ Minimal .gitignore matcher for the native walker. Supports the
+    common subset of the syntax: blank lines and # comments are
+    skipped, a trailing '/' restricts a pattern to directories, a
+    pattern with a slash is anchored to the directory of its .gitignore
+    file and everything else matches against entry basenames anywhere
+    below it. Negations ('!') and '**' are not supported; such lines
+    are ignored, so matching errs on the side of searching too much
+    rather than skipping wanted files.
+    """
+    def __init__(self, base_dir, lines):
+        self.base_prefix = base_dir.rstrip('/') + '/'
+        self.patterns = []
+        for line in lines:
+            line = line.rstrip()
+            if not line or line.startswith('#') or line.startswith('!'):
+                continue
+            if '**' in line:
+                continue
+            dir_only = line.endswith('/')
+            line = line.rstrip('/')
+            anchored = '/' in line
+            line = line.lstrip('/')
+            self.patterns.append(
+                (anchored, dir_only, re.compile(fnmatch.translate(line))))
+
+    @classmethod
+    def load(cls, directory):
+        """ Returns a matcher for the .gitignore in 'directory', or None
+        if there is none (or it is unreadable).
+        """
+        try:
+            # The searched tree is arbitrary input; replace undecodable
+            # bytes instead of letting a stray non-UTF-8 .gitignore
+            # abort the whole walk.
+            with open(os.path.join(directory, '.gitignore'),
+                      encoding='utf-8', errors='replace') as tmp_file:
+                return cls(directory, tmp_file.read().splitlines())
+        except OSError:
+            return None
+
+    def matches(self, entry_path, entry_name, is_dir):
+        """ Returns True if the entry is ignored by one of the patterns. """
+        relative_path = None
+        for anchored, dir_only, regex in self.patterns:
+            if dir_only and not is_dir:
+                continue
+            if anchored:
+                if relative_path is None:
+                    # The walker builds paths below base_prefix, so the
+                    # relative path is a plain prefix slice.
+                    relative_path = entry_path[len(self.base_prefix):]
+                if regex.match(relative_path):
+                    return True
+            elif regex.match(entry_name):
+                return True
+        return False
+
+
+def walk_scandir(root, skip_dirs, honor_gitignore=False):
+    """ Yields an os.DirEntry for every file below 'root', walking the
+    tree iteratively with an explicit stack of pending directories.
+    Directories whose name is in 'skip_dirs' are pruned before they are
+    pushed, so they are never read at all. With 'honor_gitignore', each
+    directory's .gitignore is read once on entry and pushed onto a
+    per-branch matcher stack; ignored entries are pruned the same way.
+    DirEntry carries the file type from the directory read (d_type),
+    therefore the traversal itself issues no stat() calls and is not
+    bounded by the interpreter recursion limit on deeply nested trees.
+    """
+    pending = deque([(root, ())])
+    while pending:
+        directory, ignore_stack = pending.pop()
+        try:
+            entries = os.scandir(directory)
+        except OSError as error:
+            sys.stderr.write(str(error) + '\n')
+            continue
+        if honor_gitignore:
+            matcher = GitignoreMatcher.load(directory)
+            if matcher is not None:
+                ignore_stack = ignore_stack + (matcher,)
+        with entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if (entry.name not in skip_dirs and
+                                not any(matcher.matches(entry.path,
+                                                        entry.name, True)
+                                        for matcher in ignore_stack)):
+                            pending.append((entry.path, ignore_stack))
+                    elif entry.is_file(follow_symlinks=False):
+                        if not any(matcher.matches(entry.path,
+                                                   entry.name, False)
+                                   for matcher in ignore_stack):
+                            yield entry
+                except OSError:
+                    continue
+
+
+def glob_to_posix_regex(pattern):
+    """ Translates a shell glob 'pattern' (as understood by `find -name`)
+    into a posix-extended regular expression for `find -regex`.
+    '*' and '?' don't cross directory separators; character classes in
+    square brackets are passed through unchanged.
+    """
+    parts = []
+    for char in pattern:
+        if char == '*':
+            parts.append('[^/]*')
+        elif char == '?':
+            parts.append('[^/]')
+        elif char in '[]!':
+            parts.append(char)
+        elif char in '.^$+(){}|\\':
+            parts.append('\\' + char)
+        else:
+            parts.append(char)
+    return ''.join(parts)
+
+
+def execute_and_print_stdout_while_running(argv, utf8=False):
+    """ Executes the command given as 'argv' token list and prints the
+    standard output of the subprocess while it is running. Returns
     after the subprocess exited.
+    Unless 'utf8' is True, the subprocess runs under the C locale.
+    This lets grep skip multibyte decoding and collation, which
+    speeds up matching considerably on ASCII trees.
     """
-    # Popen() observations
-    # ====================
-    # subprocess.Popen(command=, shell=, ...)
-    # Try not to use shell=True! Please refer to security warning at
-    # <https://docs.python.org/2/library/subprocess.html#popen-constructor>
-    #
-    # Popen() in GitBash on Windows 10
-    # --------------------------------
-    # - shell=False
-    #     - Parameter command is passed to cmd.exe
-    #     - command is of type list
-    # - shell=True
-    #     - Parameter command is passed to bash
-    #     - command is of type string
-    # - Example: find "." \( -iname "*.sh" -o -iname "*.py" \)
-    #     - Here, Popen() doesn't accept double quotes with parameter shell=True.
-    #       Therefore, 'Quote\'' is used instead of "Quote'" in this script.
-    # Popen() on Linux
-    # ----------------
-    # - shell=False
-    #     - command is of type list
-    # TODO: I think these worked:
-    # cmd = [ 'find', '.', '\\(',  '-iname', '\\*.sh', '-o', '-iname', '\\*.py', '\\)' ]
-    # or ...
-    # cmd = [ 'find', '.', '\\(',  '-iname', '\'*.sh\'', '-o', '-iname', '\'*.py\'', '\\)' ]
-    if platform.system() == 'Windows':
-        process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE,
-                                   stderr=subprocess.STDOUT)
+    if utf8:
+        env = None
     else:
-        process = subprocess.Popen(shlex.split(command), shell=False, stdout=subprocess.PIPE,
-                                   stderr=subprocess.STDOUT)
+        env = dict(os.environ, LC_ALL='C', LANG='C')
+    # The argv list is handed to Popen() as-is; no shell is involved,
+    # so no quoting or escaping of the tokens is necessary on any
+    # platform. Please refer to the security warning at
+    # <https://docs.python.org/3/library/subprocess.html#security-considerations>
+    process = subprocess.Popen(argv, shell=False, stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT, env=env)
+    # Pump the output in bulk chunks instead of line by line. A search
+    # can return hundreds of thousands of lines; per-line readline(),
+    # decode() and flush() calls in Python would dominate the runtime.
+    # The bytes are forwarded unmodified, so grep's coloring survives.
+    fd = process.stdout.fileno()
+    os.set_blocking(fd, True)
     while True:
+        chunk = os.read(fd, 1 << 16)
+        if not chunk:
+            # An empty read on the blocking pipe means EOF. The
+            # child's state doesn't need to be polled per chunk;
+            # it is reaped once below.
+            break
         try:
-            line = process.stdout.readline().decode('utf-8')
-            if process.poll() is not None and '' == line:
-                break
-            sys.stdout.write(line)
-            sys.stdout.flush()
-        except:
-            sys.stderr.write('Cannot process line properly\n')
+            sys.stdout.buffer.write(chunk)
+        except BrokenPipeError:
+            # Our own stdout is gone (e.g. piped into head). The child
+            # is likely blocked writing into the now-unread pipe, so it
+            # must be killed before wait() - otherwise both sides wait
+            # on each other forever.
+            process.kill()
+            break
+    try:
+        sys.stdout.buffer.flush()
+    except BrokenPipeError:
+        pass
+    process.wait()
+
 
-    # exit_code = process.wait()
-    # if exit_code != 0:
+def execute_and_return_stdout(argv, utf8=False):
+    """ Executes the command given as 'argv' token list and returns its
+    combined output as bytes after the subprocess exited. Used for the
+    parallel -j searches, whose output must not interleave chunk-wise.
+    The locale handling matches execute_and_print_stdout_while_running.
+    """
+    if utf8:
+        env = None
+    else:
+        env = dict(os.environ, LC_ALL='C', LANG='C')
+    process = subprocess.run(argv, stdout=subprocess.PIPE,
+                             stderr=subprocess.STDOUT, env=env)
+    return process.stdout
 
 
 def dialog_yes_no(question, default_answer=None):